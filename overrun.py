@@ -2,97 +2,389 @@
 Subprocess run tool, that makes the syntax for running a subprocess easier
 '''
 
-from contextlib import contextmanager
+import asyncio
 import subprocess
 import string
 import sys
-import inspect
+import functools
+import itertools
+import locale
+import os
 import shlex
+import shutil
+from types import CodeType, FrameType
+from typing import (
+    IO, Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union, cast)
 
+# A token returned from `_parse_cmd`, either ('lit', text) or ('field', expr, conversion, spec)
+_Token = Tuple[Any, ...]
+# `(expr, conversion, format_spec)` of a replacement field
+_Field = Tuple[str, Optional[str], str]
+# The `(fields, parts)` returned from `_compile_template`
+_Template = Tuple[Tuple[_Field, ...], Tuple[Any, ...]]
+_Evaluator = Callable[[str], Any]
 
-class _SimpleFormatter(string.Formatter):
+
+def _parse_cmd(command: str) -> List[_Token]:
     '''
-    Formats the given string by using the default string.format implementation.
-    The output of this formatter returns a string with {0}, {1}, etc, and stores the output in the
-    `args` field.
-    `format2()` must be used on the output value of `format()` for this formatter.
+    Parses the format string `command` in a single pass, returning a list of tokens. Literal text is
+    returned as `('lit', text)` (with {{ and }} already unescaped), and each replacement field is
+    returned as `('field', expr, conversion, format_spec)`.
+    Unlike `string.Formatter.parse`, brackets and string literals inside a field are tracked, so
+    that expressions like {"a".join("12345")} or {d["a:b"]} are kept intact.
     '''
-
-    def __init__(self, *, shell=False):
-        self.args = []
-        self._shell = shell
-
-    def _shell_quote(self, value, format_spec):
-        if format_spec == 'l':  # list
-            return [self._shell_quote(v, '') for v in value]
-        if value is None:
-            str_value = ''
+    tokens = []
+    literal = []
+    length = len(command)
+    i = 0
+    while i < length:
+        c = command[i]
+        if c == '{':
+            if command.startswith('{', i + 1):
+                literal.append('{')
+                i += 2
+                continue
+            if literal:
+                tokens.append(('lit', ''.join(literal)))
+                literal = []
+            i = _parse_field(command, i + 1, tokens)
+        elif c == '}':
+            if not command.startswith('}', i + 1):
+                raise ValueError("Single '}' encountered in format string")
+            literal.append('}')
+            i += 2
         else:
-            str_value = str(value)
-        if self._shell:
-            if format_spec == 'r':  # raw
-                return str_value
-            else:
-                return shlex.quote(str_value)
-        else:
-            return str_value
+            literal.append(c)
+            i += 1
+    if literal:
+        tokens.append(('lit', ''.join(literal)))
+    return tokens
 
-    def parse(self, format_string):
-        return ((literal.replace('{', '{{').replace('}', '}}'), field_name, format_spec, conversion)
-                for literal, field_name, format_spec, conversion in super().parse(format_string))
 
-    def format_field(self, value, format_spec):
-        index = len(self.args)
-        self.args.append(self._shell_quote(value, format_spec))
-        if format_spec == 'l':
-            return ' '.join(f'{{{index}[{i}]}}' for i in range(len(value)))
+def _parse_field(command: str, start: int, tokens: List[_Token]) -> int:
+    '''
+    Parses the replacement field starting at index `start` (just after the opening brace), appends
+    the field token to `tokens` and returns the index just after the closing brace.
+    '''
+    length = len(command)
+    depth = 0
+    quote = None
+    conversion = None
+    expr_end = None
+    i = start
+    while i < length:
+        c = command[i]
+        if quote:
+            if c == '\\':
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '([{':
+            depth += 1
+        elif depth:
+            if c in ')]}':
+                depth -= 1
+        elif c == '}':
+            tokens.append(('field', command[start:expr_end or i], conversion, ''))
+            return i + 1
+        elif c == ':':
+            spec_end = _find_spec_end(command, i + 1)
+            tokens.append(
+                ('field', command[start:expr_end or i], conversion, command[i + 1:spec_end]))
+            return spec_end + 1
+        elif (c == '!' and command[i + 1:i + 2] in ('r', 's', 'a')
+              and command[i + 2:i + 3] in (':', '}')):
+            conversion = command[i + 1]
+            expr_end = i
+            i += 2
+            continue
+        i += 1
+    raise ValueError("expected '}' before end of string")
+
+
+def _find_spec_end(command: str, start: int) -> int:
+    depth = 0
+    for i in range(start, len(command)):
+        c = command[i]
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            if not depth:
+                return i
+            depth -= 1
+    raise ValueError("expected '}' before end of string")
+
+
+def _convert(value: Any, conversion: Optional[str]) -> Any:
+    if conversion is None:
+        return value
+    if conversion == 'r':
+        return repr(value)
+    if conversion == 'a':
+        return ascii(value)
+    return str(value)
+
+
+def _to_str(value: Any) -> str:
+    return '' if value is None else str(value)
+
+
+# The characters that `shlex.quote` leaves unquoted
+_SAFE_CHARS = frozenset(string.ascii_letters + string.digits + '@%+=:,./-_')
+_SAFE_BYTES = bytes(sorted(map(ord, _SAFE_CHARS)))
+
+
+def _quote(s: str) -> str:
+    '''
+    Same as `shlex.quote`, but checks the characters against a lookup table instead of running a
+    regex search over the string.
+    '''
+    if not s:
+        return "''"
+    if len(s) < 16:
+        if _SAFE_CHARS.issuperset(s):
+            return s
+    # For longer strings, deleting all the safe bytes with bytes.translate is faster
+    elif s.isascii() and not s.encode('ascii').translate(None, _SAFE_BYTES):
+        return s
+    return "'" + s.replace("'", "'\"'\"'") + "'"
+
+
+def _shell_quote(value: Any, format_spec: str) -> str:
+    if format_spec == 'l':  # list
+        return ' '.join([_quote(_to_str(v)) for v in value])
+    if format_spec == 'r':  # raw
+        return _to_str(value)
+    return _quote(_to_str(value))
+
+
+@functools.lru_cache(maxsize=512)
+def _compile_template(command: str, shell: bool) -> _Template:
+    '''
+    Compiles the format string `command` into a tuple of `(fields, parts)`, where `fields` is a
+    tuple of `(expr, conversion, format_spec)` for each replacement field. Templates are expected to
+    be string literals, so the result is cached and only the evaluation of the fields is left for
+    each call.
+
+    If `shell` is true, `parts` is a tuple of literal strings and field indices. Otherwise `parts`
+    is the tuple of words returned from `_split_words`.
+    '''
+    tokens = _parse_cmd(command)
+    if not shell:
+        return _split_words(tokens)
+    fields: List[_Field] = []
+    parts: List[Union[str, int]] = []
+    for token in tokens:
+        if token[0] == 'lit':
+            parts.append(token[1])
         else:
-            return f'{{{index}}}'
+            parts.append(len(fields))
+            fields.append(cast(_Field, token[1:]))
+    return tuple(fields), tuple(parts)
 
-    def get_field(self, field_name, args, kwargs):
-        value, used_fields = super().get_field(field_name, args, kwargs)
-        return value, used_fields
 
-    def format2(self, format_string):
-        return format_string.format(*self.args)
+_WHITESPACE = ' \t\r\n'
 
 
-class _EvalFormatter(_SimpleFormatter):
+def _split_words(tokens: List[_Token]) -> _Template:
     '''
-    Formats the given string by evaluating all of the "fields" as code in its original context,
-    making it behave like f-strings.
-    The output of this formatter returns a string with {0}, {1}, etc, and stores the output in the
-    `args` field.
-    `format2()` must be used on the output value of `format()` for this formatter.
+    Splits the tokens returned from `_parse_cmd` into words, following the same quoting rules as
+    `shlex.split`. Field values are never split, so they can be inserted verbatim later.
+    Returns `(fields, words)`. Words without any fields are joined into a plain string ahead of
+    time. Other words are tuples of literal strings and `(field_index, kind)` pairs, where `kind`
+    is 's' for a single value, 'l' for a list that is split into separate arguments, and 'j' for a
+    list that appears inside quotes and is joined with spaces.
     '''
-    def __init__(self, evaluator):
-        super().__init__()
-        self.evaluator = evaluator
-
-    def get_field(self, field_name, args, kwargs):
-        value = self.evaluator(field_name)
-        return value, field_name
-
-
-class CallerEval:
+    fields: List[_Field] = []
+    words: List[Union[str, Tuple[Any, ...]]] = []
+    # The parts of the current word, or None if we are in between words
+    word: Optional[List[Any]] = None
+    literal: List[str] = []
+    quote = None
+    escaped = False
+    for token in tokens:
+        if token[0] == 'field':
+            if word is None:
+                word = []
+            if escaped:
+                if quote:
+                    literal.append('\\')
+                escaped = False
+            if literal:
+                word.append(''.join(literal))
+                literal = []
+            if token[3] != 'l':
+                kind = 's'
+            else:
+                kind = 'j' if quote else 'l'
+            word.append((len(fields), kind))
+            fields.append(cast(_Field, token[1:]))
+            continue
+        for c in token[1]:
+            if escaped:
+                # Inside double quotes, only the quote or the escape character can be escaped
+                if quote and c != quote and c != '\\':
+                    literal.append('\\')
+                literal.append(c)
+                escaped = False
+            elif quote:
+                if c == quote:
+                    quote = None
+                elif c == '\\' and quote == '"':
+                    escaped = True
+                else:
+                    literal.append(c)
+            elif c in _WHITESPACE:
+                if word is not None:
+                    if literal:
+                        word.append(''.join(literal))
+                        literal = []
+                    words.append(_finish_word(word))
+                    word = None
+            else:
+                if word is None:
+                    word = []
+                if c == '\\':
+                    escaped = True
+                elif c in '\'"':
+                    quote = c
+                    literal.append('')  # Quotes always produce a word, even if empty
+                else:
+                    literal.append(c)
+    if escaped:
+        raise ValueError('No escaped character')
+    if quote:
+        raise ValueError('No closing quotation')
+    if word is not None:
+        if literal:
+            word.append(''.join(literal))
+        words.append(_finish_word(word))
+    return tuple(fields), tuple(words)
+
+
+def _finish_word(word: List[Any]) -> Union[str, Tuple[Any, ...]]:
+    for part in word:
+        if type(part) is not str:
+            return tuple(word)
+    return ''.join(word)
+
+
+def _format_template(template: _Template, evaluator: _Evaluator,
+                     shell: bool) -> Union[str, List[str]]:
+    '''
+    Evaluates all the fields in the `template` returned from `_compile_template` using `evaluator`,
+    inserting each value into the output as soon as it is evaluated.
+    If `shell` is true, the fields are shell quoted in place and the command string is returned.
+    Otherwise a list of arguments is returned, with the field values inserted verbatim.
+    '''
+    fields, parts = template
+    if shell:
+        out = []
+        for part in parts:
+            if type(part) is str:
+                out.append(part)
+            else:
+                expr, conversion, format_spec = fields[part]
+                out.append(_shell_quote(_convert(evaluator(expr), conversion), format_spec))
+        return ''.join(out)
+    argv = []
+    for word in parts:
+        if type(word) is str:
+            argv.append(word)
+            continue
+        current = []
+        empty = True
+        for part in word:
+            if type(part) is str:
+                current.append(part)
+                empty = False
+                continue
+            index, kind = part
+            expr, conversion, _ = fields[index]
+            value = _convert(evaluator(expr), conversion)
+            if kind == 's':
+                current.append(_to_str(value))
+                empty = False
+                continue
+            value = [_to_str(v) for v in value]
+            if kind == 'j':
+                current.append(' '.join(value))
+                empty = False
+            elif value:
+                empty = False
+                current.append(value[0])
+                if len(value) > 1:
+                    argv.append(''.join(current))
+                    argv.extend(value[1:-1])
+                    current = [value[-1]]
+        # Empty lists that are not quoted or next to anything else do not add an argument
+        if not empty:
+            argv.append(''.join(current))
+    return argv
+
+
+# Only used for looking up fields, which does not depend on any state in the formatter
+_FIELD_FORMATTER = string.Formatter()
+
+
+def _field_evaluator(args: Sequence[Any], kwargs: Dict[str, Any]) -> _Evaluator:
     '''
-    Context manager that yields an eval function, which evaluates the given expression in the context
-    of the caller (more specifically the caller of `CallerEval()`).
+    Returns an evaluator that looks up the field names in `args` and `kwargs`, the same way that
+    `str.format` does.
     '''
-    def __init__(self):
-        self.frame = inspect.currentframe().f_back.f_back
+    auto_index = itertools.count()
+    numbering = ''  # Becomes 'auto' or 'manual' once a positional field has been seen
+
+    def evaluate(field_name: str) -> Any:
+        nonlocal numbering
+        first = field_name.partition('.')[0].partition('[')[0]
+        if not first:
+            if numbering == 'manual':
+                raise ValueError(
+                    'cannot switch from manual field specification to automatic field numbering')
+            numbering = 'auto'
+            field_name = str(next(auto_index)) + field_name
+        elif first.isdigit():
+            if numbering == 'auto':
+                raise ValueError(
+                    'cannot switch from automatic field numbering to manual field specification')
+            numbering = 'manual'
+        return _FIELD_FORMATTER.get_field(field_name, args, kwargs)[0]
+    return evaluate
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_expr(expr: str) -> CodeType:
+    return compile(expr, '<overrun-cmd>', 'eval')
+
+
+def _caller_frame() -> FrameType:
+    '''
+    Returns the frame of the code that called into this module. The frames of this module are
+    skipped by name instead of by count, since functions compiled with mypyc do not have frames.
+    '''
+    frame = sys._getframe(0)
+    while frame.f_globals.get('__name__') == __name__:
+        frame = cast(FrameType, frame.f_back)
+    return frame
 
-    def _eval(self, expr):
-        return eval(expr, self.frame.f_globals, self.frame.f_locals)
 
-    def __enter__(self):
-        return self._eval
+def _caller_eval(frame: FrameType) -> _Evaluator:
+    '''
+    Returns an eval function, which evaluates the given expression in the context of `frame`.
+    '''
+    f_globals = frame.f_globals
+    f_locals = frame.f_locals
 
-    def __exit__(self, *exc):
-        del self.frame
+    def evaluate(expr: str) -> Any:
+        return eval(_compile_expr(expr), f_globals, f_locals)
+    return evaluate
 
 
-def cmd(*command, shell=False, evaluator=None, warn_uncalled=True):
+def cmd(*command: Any, shell: bool = False, evaluator: Optional[_Evaluator] = None,
+        warn_uncalled: bool = True) -> 'CmdObject':
     '''
     A command object that can be executed with `.call()`, `.run()`, or `.read()`. The input command
     can one or more strings. Falsy values are filtered out from the list and then joined using with
@@ -125,44 +417,110 @@ def cmd(*command, shell=False, evaluator=None, warn_uncalled=True):
     Good: cmd('echo {name}')
     Bad: cmd(my_command_argument)
     '''
-    command = ' '.join(str(t) for t in command if t)
-    with (nullcontext(evaluator) if evaluator else CallerEval()) as evaluator:
-        return format_cmd(command,
-            formatter=_EvalFormatter(evaluator),
-            shell=shell,
-            warn_uncalled=warn_uncalled)
+    if len(command) == 1 and type(command[0]) is str:
+        command_str: str = command[0]
+    else:
+        command_str = ' '.join([t if type(t) is str else str(t) for t in command if t])
+    if '{' not in command_str and '}' not in command_str:
+        # Nothing to evaluate, so skip capturing the caller's frame
+        if shell:
+            return CmdObject(command_str, shell=True, warn_uncalled=warn_uncalled)
+        # Without any fields, all of the compiled words are plain strings
+        argv = list(_compile_template(command_str, False)[1])
+        return CmdObject(argv, shell=False, warn_uncalled=warn_uncalled)
+    if evaluator is None:
+        evaluator = _caller_eval(_caller_frame())
+    return format_cmd(command_str,
+        evaluator=evaluator,
+        shell=shell,
+        warn_uncalled=warn_uncalled)
+
+
+def format_cmd(command: str, *args: Any, evaluator: Optional[_Evaluator] = None,
+               shell: bool = False, warn_uncalled: bool = True, **kwargs: Any) -> 'CmdObject':
+    '''
+    Same as `cmd`, but with less magic. Instead of automatically evaluating all of the fields in the
+    command, this behaves more like traditional str.format, expecting the field values to be passed
+    in through the `args` and `kwargs` of this method.
+    If `evaluator` is given, it is called with the expression of each field instead.
+    '''
+    evaluator = evaluator or _field_evaluator(args, kwargs)
+    return CmdObject(_format_template(_compile_template(command, shell), evaluator, shell),
+                     shell=shell, warn_uncalled=warn_uncalled)
 
 
-@contextmanager
-def nullcontext(value):
-    yield value
+_READ_CHUNK_SIZE = 65536
 
+# Arguments that need the `subprocess.run` path of `CmdObject.read()`
+_RUN_ONLY_ARGS = frozenset((
+    'check', 'input', 'timeout', 'capture_output', 'universal_newlines', 'text', 'encoding',
+    'errors'))
 
-def format_cmd(command, *args, formatter=None, shell=False, warn_uncalled=True, **kwargs):
+
+def _decode_output(data: Union[bytes, bytearray]) -> str:
     '''
-    Same as `cmd`, but with less magic. Instead of automatically evaluating all of the fields in the
-    command, this behaves more like traditional str.format, expecting the field values to be passed
-    in through the `args` and `kwargs` of this method.
+    Decodes the output of a process the same way as `universal_newlines=True` in subprocess.
     '''
-    formatter = formatter or _SimpleFormatter()
-    formatter._shell = shell
-    first_result = formatter.format(command, *args, **kwargs)
-    if shell:
-        second_result = formatter.format2(first_result)
-    else:
-        second_result = [formatter.format2(token) for token in shlex.split(first_result)]
-    return CmdObject(second_result, shell=shell, warn_uncalled=warn_uncalled)
+    text = data.decode(locale.getpreferredencoding(False))
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+# Popen arguments that stop subprocess from starting the process with `os.posix_spawn`
+_POSIX_SPAWN_BLOCKERS = frozenset((
+    'preexec_fn', 'pass_fds', 'cwd', 'start_new_session', 'process_group', 'group',
+    'extra_groups', 'user', 'umask'))
+
+# Whether subprocess only uses `os.posix_spawn` with `close_fds=False`. Python 3.13+ can also use it
+# with `close_fds=True` where posix_spawn_file_actions_addclosefrom_np is available.
+_POSIX_SPAWN_NEEDS_OPEN_FDS: bool = (
+    getattr(subprocess, '_USE_POSIX_SPAWN', False)
+    and not getattr(subprocess, '_HAVE_POSIX_SPAWN_CLOSEFROM', False))
+
+
+def _posix_spawn_kwargs(cmd: Union[str, List[str]], shell: bool,
+                        kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Returns `kwargs` updated so that subprocess can start the process with `os.posix_spawn`, which
+    is cheaper than fork + exec, on platforms where subprocess supports it. This turns off
+    `close_fds` if subprocess needs it to use `posix_spawn`, and resolves the executable to a full
+    path using `PATH`.
+    Raises ValueError if `kwargs` contains options that `posix_spawn` cannot be used with.
+    Note that redirecting stdin, stdout or stderr to file descriptors 0-2 also disables it.
+    '''
+    blockers = kwargs.keys() & _POSIX_SPAWN_BLOCKERS
+    if _POSIX_SPAWN_NEEDS_OPEN_FDS and kwargs.get('close_fds'):
+        blockers.add('close_fds')
+    if blockers:
+        raise ValueError(f'fast=True cannot be used with: {", ".join(sorted(blockers))}')
+    if _POSIX_SPAWN_NEEDS_OPEN_FDS:
+        kwargs = {'close_fds': False, **kwargs}
+    # With shell=True, the executable is the shell, which defaults to an absolute path
+    program = kwargs.get('executable')
+    if program is None and not shell and cmd:
+        program = cmd[0]
+    if program and not os.path.dirname(program):
+        path = os.pathsep.join(os.get_exec_path(kwargs.get('env')))
+        executable = shutil.which(program, path=path)
+        if executable:
+            kwargs = {**kwargs, 'executable': executable}
+    return kwargs
 
 
 class CmdObject:
-    def __init__(self, cmd, *, shell, warn_uncalled=True):
+    def __init__(self, cmd: Union[str, List[str]], *, shell: bool,
+                 warn_uncalled: bool = True) -> None:
         self._called = not warn_uncalled
         self.cmd = cmd
         self._shell = shell
-        self.result = None
+        self.result: Optional[CompletedProcess] = None
 
-    def _call(self, *, verbose=False, silent=False, **kwargs):
+    def _prepare_call(self, verbose: bool, silent: bool, fast: bool,
+                      kwargs: Dict[str, Any]) -> Dict[str, Any]:
         self._called = True
+        if fast:
+            kwargs = _posix_spawn_kwargs(self.cmd, self._shell, kwargs)
         if verbose:
             print(f'Run command: {self._display_cmd()}', file=sys.stderr)
         if silent:
@@ -171,62 +529,196 @@ class CmdObject:
                 'stderr': subprocess.DEVNULL,
                 **kwargs
             }
+        return kwargs
+
+    def _call(self, *, verbose: bool = False, silent: bool = False, fast: bool = False,
+              **kwargs: Any) -> 'CompletedProcess':
+        kwargs = self._prepare_call(verbose, silent, fast, kwargs)
         self.result = CompletedProcess(
             subprocess.run(self.cmd, shell=self._shell, **kwargs))
         return self.result
 
-    def run(self, **kwargs):
+    def _read_fast(self, *, verbose: bool = False, silent: bool = False, fast: bool = False,
+                   **kwargs: Any) -> str:
+        '''
+        Same as `call(stdout=PIPE, universal_newlines=True).stdout` without the trailing newlines,
+        but reads from the pipe directly instead of going through `subprocess.run`. The newlines
+        are dropped before decoding, so the output is only copied once.
+        '''
+        kwargs = self._prepare_call(
+            verbose, silent, fast, {'stdout': subprocess.PIPE, **kwargs})
+        with subprocess.Popen(self.cmd, shell=self._shell, **kwargs) as process:
+            try:
+                if process.stdin:
+                    process.stdin.close()
+                buf = bytearray()
+                read = cast(IO[bytes], process.stdout).read
+                while True:
+                    chunk = read(_READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    buf += chunk
+            except:
+                process.kill()
+                raise
+        end = len(buf)
+        while end and buf[end - 1] in b'\r\n':
+            end -= 1
+        del buf[end:]
+        out = _decode_output(buf)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, process.args, output=out)
+        self.result = CompletedProcess(
+            subprocess.CompletedProcess(process.args, process.returncode, out))
+        return out
+
+    def run(self, **kwargs: Any) -> 'CompletedProcess':
         return self._call(**kwargs)
 
-    def call(self, check=True, **kwargs):
+    def call(self, check: bool = True, **kwargs: Any) -> 'CompletedProcess':
         return self._call(check=check, **kwargs)
 
-    def read(self, **kwargs):
-        return self.call(stdout=subprocess.PIPE, universal_newlines=True, **kwargs).stdout.rstrip('\n')
+    def read(self, **kwargs: Any) -> str:
+        if kwargs.keys() & _RUN_ONLY_ARGS or kwargs.get('stderr') == subprocess.PIPE:
+            return self.call(stdout=subprocess.PIPE, universal_newlines=True, **kwargs).stdout.rstrip('\n')
+        return self._read_fast(**kwargs)
+
+    async def call_async(self, check: bool = True, *, verbose: bool = False, silent: bool = False,
+                         fast: bool = False, **kwargs: Any) -> 'CompletedProcess':
+        '''
+        Same as `call()`, but runs the command as an asyncio subprocess so that other commands can
+        run at the same time. `kwargs` are passed to `asyncio.create_subprocess_exec` (or
+        `create_subprocess_shell`), which does not support text mode. See also `run_all()`.
+        '''
+        kwargs = self._prepare_call(verbose, silent, fast, kwargs)
+        if self._shell:
+            process = await asyncio.create_subprocess_shell(cast(str, self.cmd), **kwargs)
+        else:
+            process = await asyncio.create_subprocess_exec(*self.cmd, **kwargs)
+        try:
+            # typeshed says this returns bytes, but they are None for streams that are not piped,
+            # and mypyc would check the declared type at runtime
+            communicate = cast(Callable[[], Awaitable[Tuple[Optional[bytes], Optional[bytes]]]],
+                               process.communicate)
+            output = await communicate()
+        except BaseException as error:
+            # e.g. cancelled by run_all() because another command failed
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            # Re-raise explicitly: a bare `raise` after an `await` is not reliable under mypyc
+            raise error
+        completed_process = subprocess.CompletedProcess(
+            self.cmd, cast(int, process.returncode), *output)
+        if check:
+            completed_process.check_returncode()
+        self.result = CompletedProcess(completed_process)
+        return self.result
 
-    def popen(self, **kwargs):
+    def popen(self, **kwargs: Any) -> 'subprocess.Popen[Any]':
         self._called = True
         return subprocess.Popen(self.cmd, shell=self._shell, **kwargs)
 
-    def _display_cmd(self):
+    def _display_cmd(self) -> str:
         return ' '.join(shlex.quote(x) for x in self.cmd)
 
-    def __repr__(self):
+    def __repr__(self) -> str:
         return f'CmdObject(cmd={self.cmd})'
 
-    def __del__(self):
-        if not self._called:
+    def __del__(self) -> None:
+        if not self._called and _WARN:
             print(f'Warning: Uncalled {self}', file=sys.stderr)
 
 
+_WARN = True
+
+
+def set_warn(enabled: bool) -> None:
+    '''
+    Enables or disables the warnings for uncalled commands and unchecked failed processes globally.
+    '''
+    global _WARN
+    _WARN = enabled
+
+
+def run_all(cmds: Iterable[CmdObject], *, concurrency: Optional[int] = None,
+            **kwargs: Any) -> List['CompletedProcess']:
+    '''
+    Runs all of the given command objects with `call_async()`, with at most `concurrency` of them
+    running at the same time (defaults to the number of CPUs). `kwargs` are passed to each
+    `call_async()`. Returns the list of results in the same order as `cmds`.
+    If any of the commands fails, the ones that are still running are killed, and the error is
+    raised once all of them have exited.
+
+    e.g. run_all([cmd('lint {f}') for f in files])
+    '''
+    if concurrency is None:
+        concurrency = os.cpu_count() or 1
+    if concurrency < 1:
+        raise ValueError(f'concurrency must be at least 1, got {concurrency}')
+    cmds = list(cmds)
+    for command in cmds:
+        # Commands waiting for their turn are owned by run_all, so they should not be reported as
+        # uncalled if they are cancelled.
+        command._called = True
+    return asyncio.run(_run_all(cmds, concurrency, kwargs))
+
+
+async def _run_all(cmds: List[CmdObject], concurrency: int,
+                   kwargs: Dict[str, Any]) -> List['CompletedProcess']:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(command: CmdObject) -> 'CompletedProcess':
+        async with semaphore:
+            return await command.call_async(**kwargs)
+    tasks = [asyncio.ensure_future(run(command)) for command in cmds]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException as error:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise error
+
+
 class CompletedProcess:
+    __slots__ = ('completed_process', '_checked')
 
-    def __init__(self, completed_process):
+    def __init__(self, completed_process: 'subprocess.CompletedProcess[Any]') -> None:
         self.completed_process = completed_process
         self._checked = False
 
-    def check_returncode(self):
+    def check_returncode(self) -> None:
         self._checked = True
         return self.completed_process.check_returncode()
 
-    def __getattr__(self, name):
-        if name == 'returncode':
-            self._checked = True
-        return getattr(self.completed_process, name)
+    @property
+    def args(self) -> Any:
+        return self.completed_process.args
+
+    @property
+    def returncode(self) -> int:
+        self._checked = True
+        return self.completed_process.returncode
+
+    @property
+    def stdout(self) -> Any:
+        return self.completed_process.stdout
+
+    @property
+    def stderr(self) -> Any:
+        return self.completed_process.stderr
 
-    def __repr__(self):
+    def __repr__(self) -> str:
         return repr(self.completed_process)
 
-    def __str__(self):
+    def __str__(self) -> str:
         return str(self.completed_process)
 
-    def __bool__(self):
-        try:
-            self.check_returncode()
-            return True
-        except subprocess.CalledProcessError:
-            return False
+    def __bool__(self) -> bool:
+        self._checked = True
+        return self.completed_process.returncode == 0
 
-    def __del__(self):
-        if not self._checked and not bool(self):
+    def __del__(self) -> None:
+        if not self._checked and self.completed_process.returncode and _WARN:
             print(f'Warning: Unchecked failed subprocess: {self}', file=sys.stderr)
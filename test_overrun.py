@@ -1,5 +1,13 @@
-from overrun import cmd, format_cmd
+from overrun import cmd, format_cmd, run_all, set_warn
+import contextlib
+import io
+import os
+import shlex
+import subprocess
+import tempfile
+import time
 import unittest
+from unittest import mock
 
 
 class TestOverrun(unittest.TestCase):
@@ -32,6 +40,111 @@ class TestOverrun(unittest.TestCase):
         proc = cmd('ls /non_existent_directory', shell=self.shell).run(silent=True)
         self.assertFalse(proc)
 
+    def test_read_fail(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            cmd('ls /non_existent_directory', shell=self.shell).read(silent=True)
+
+    def test_read_no_check(self):
+        value = cmd('ls /non_existent_directory', shell=self.shell).read(check=False, silent=True)
+        self.assertEqual(value, '')
+
+    def test_run_all(self):
+        results = run_all([cmd('printf "[%s]" {i}', shell=self.shell) for i in range(5)],
+                          concurrency=2, stdout=subprocess.PIPE)
+        self.assertEqual([r.stdout for r in results], [f'[{i}]'.encode() for i in range(5)])
+
+    def test_run_all_fail(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_all([cmd('ls /non_existent_directory', shell=self.shell)], silent=True)
+
+    def test_run_all_fail_kills_running(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            marker = os.path.join(tmp, 'marker')
+            script = f'sleep 1; touch {marker}'
+            slow = cmd('{script:r}', shell=True) if self.shell else cmd('sh -c {script}')
+            stderr = io.StringIO()
+            start = time.monotonic()
+            with contextlib.redirect_stderr(stderr):
+                with self.assertRaises(subprocess.CalledProcessError):
+                    run_all([slow,
+                             cmd('false', shell=self.shell),
+                             cmd('ls /', shell=self.shell),
+                             cmd('ls /', shell=self.shell)],
+                            concurrency=2, stdout=subprocess.DEVNULL)
+                self.assertLess(time.monotonic() - start, 1)
+                time.sleep(1.5)
+            self.assertFalse(os.path.exists(marker))
+            self.assertNotIn('Uncalled', stderr.getvalue())
+
+    def test_run_all_concurrency(self):
+        with self.assertRaises(ValueError):
+            run_all([cmd('ls /', shell=self.shell, warn_uncalled=False)], concurrency=0)
+
+    @unittest.skipUnless(subprocess._USE_POSIX_SPAWN, 'posix_spawn is not used on this platform')
+    def test_fast_spawn(self):
+        with mock.patch('os.posix_spawn', wraps=os.posix_spawn) as posix_spawn:
+            value = cmd('printf "[%s]" {"Hello world"}', shell=self.shell).read(fast=True)
+        self.assertEqual(value, '[Hello world]')
+        posix_spawn.assert_called_once()
+
+    @unittest.skipUnless(subprocess._USE_POSIX_SPAWN, 'posix_spawn is not used on this platform')
+    def test_fast_spawn_executable(self):
+        executable = 'sh' if self.shell else 'printf'
+        with mock.patch('os.posix_spawn', wraps=os.posix_spawn) as posix_spawn:
+            value = cmd('printf "[%s]" {"Hello world"}', shell=self.shell).read(
+                fast=True, executable=executable)
+        self.assertEqual(value, '[Hello world]')
+        posix_spawn.assert_called_once()
+
+    def test_fast_spawn_empty_command(self):
+        # Same error as subprocess gives without fast=True
+        with self.assertRaises(IndexError):
+            cmd('').call(fast=True)
+
+    def test_fast_spawn_close_fds(self):
+        with mock.patch('overrun._POSIX_SPAWN_NEEDS_OPEN_FDS', False):
+            self.assertTrue(cmd('ls /', shell=self.shell).call(fast=True, close_fds=True, silent=True))
+        with mock.patch('overrun._POSIX_SPAWN_NEEDS_OPEN_FDS', True):
+            with self.assertRaises(ValueError):
+                cmd('ls /', shell=self.shell).call(fast=True, close_fds=True)
+
+    def test_fast_spawn_blocked(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            with self.assertRaises(ValueError):
+                cmd('ls /', shell=self.shell).call(fast=True, cwd='/')
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_warn_uncalled(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            cmd('ls /', shell=self.shell)
+        self.assertIn('Warning: Uncalled', stderr.getvalue())
+
+    def test_warn_unchecked(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            cmd('ls /non_existent_directory', shell=self.shell).run(silent=True)
+        self.assertIn('Warning: Unchecked failed subprocess', stderr.getvalue())
+
+    def test_no_warn_checked(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            self.assertFalse(cmd('ls /non_existent_directory', shell=self.shell).run(silent=True))
+            self.assertTrue(cmd('ls /', shell=self.shell).run(silent=True))
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_set_warn(self):
+        stderr = io.StringIO()
+        set_warn(False)
+        try:
+            with contextlib.redirect_stderr(stderr):
+                cmd('ls /', shell=self.shell)
+                cmd('ls /non_existent_directory', shell=self.shell).run(silent=True)
+        finally:
+            set_warn(True)
+        self.assertEqual(stderr.getvalue(), '')
+
     def test_conditional(self):
         value = cmd('printf "%s\n"',
                     'hello' if False else '',
@@ -63,6 +176,17 @@ class TestOverrun(unittest.TestCase):
             shell=self.shell).read()
         self.assertEqual(value, '1:Hello there 2:Chan Tai Man')
 
+    def test_manual_format_mixed_numbering(self):
+        with self.assertRaises(ValueError):
+            format_cmd('printf "%s\n" {} {0}', 'a', shell=self.shell, warn_uncalled=False)
+        with self.assertRaises(ValueError):
+            format_cmd('printf "%s\n" {0} {}', 'a', shell=self.shell, warn_uncalled=False)
+
+    def test_manual_format_numbering(self):
+        value = format_cmd('printf "%s\n" {1} {0} {name}', 'a', 'b', name='c',
+                           shell=self.shell).read()
+        self.assertEqual(value, 'b\na\nc')
+
     def test_format_into_curly_braces(self):
         '''
         Even if the interpolated variable is a python format string, it should
@@ -85,11 +209,35 @@ class TestOverrun(unittest.TestCase):
         value = cmd('printf "[%s]" {test:l}', shell=self.shell).read()
         self.assertEqual(value, '[1 2][3 4][5 6]')
 
+    def test_list_interpolation_affixes(self):
+        test = ['1', '2', '3']
+        value = cmd('printf "[%s]" --test={test:l}, "quoted {test:l}"', shell=self.shell).read()
+        self.assertEqual(value, '[--test=1][2][3,][quoted 1 2 3]')
+
+    def test_list_interpolation_empty(self):
+        test = []
+        value = cmd('printf "[%s]" {test:l} second', shell=self.shell).read()
+        self.assertEqual(value, '[second]')
+
     def test_list_interpolation_manual(self):
         test = ['1', '2', '3', '4', '5']
         value = format_cmd('printf "[%s]" {test:l}', test=test, shell=self.shell).read()
         self.assertEqual(value, '[1][2][3][4][5]')
 
+    def test_expression_with_colon(self):
+        test = {'a:b': 'Testing 123'}
+        value = cmd('printf "[%s]" {test["a:b"]}', shell=self.shell).read()
+        self.assertEqual(value, '[Testing 123]')
+
+    def test_expression_with_brackets(self):
+        value = cmd('printf "[%s]" {"}".join({1: "a", 2: "b"}.values())}', shell=self.shell).read()
+        self.assertEqual(value, '[a}b]')
+
+    def test_conversion(self):
+        test = 'Testing'
+        value = cmd('printf "[%s]" {test!r} {1 != 2}', shell=self.shell).read()
+        self.assertEqual(value, "['Testing'][True]")
+
     def test_escaped_curly_braces(self):
         value = cmd('printf "[%s]" "{{curly}}"').read()
         self.assertEqual(value, '[{curly}]')
@@ -107,6 +255,16 @@ class TestOverrunShell(TestOverrun):
         value = cmd('printf "[%s]\n" Testing{"123 45":r}', shell=True).read()
         self.assertEqual(value, '[Testing123]\n[45]')
 
+    def test_quote_long_values(self):
+        safe = 'path/to/some_long-file.name.txt'
+        unsafe = "it's a long value with spaces"
+        non_ascii = 'très-long-nom-de-fichier.txt'
+        command = cmd('printf "[%s]" {safe} {unsafe} {non_ascii}', shell=True)
+        self.assertEqual(
+            command.cmd,
+            f'printf "[%s]" {safe} {shlex.quote(unsafe)} {shlex.quote(non_ascii)}')
+        self.assertEqual(command.read(), f'[{safe}][{unsafe}][{non_ascii}]')
+
     def test_shell_true(self):
         value = cmd('yes | head -n2', shell=True).read()
         self.assertEqual(value, 'y\ny')